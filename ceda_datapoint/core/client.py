@@ -5,7 +5,6 @@ __copyright__ = "Copyright 2024 United Kingdom Research and Innovation"
 import pystac_client
 from pystac_client.stac_api_io import StacApiIO
 import logging
-import xarray
 
 from ceda_datapoint.mixins import UIMixin
 from ceda_datapoint.utils import urls, hash_id, generate_id, logstream
@@ -140,7 +139,7 @@ class DataPointSearch(UIMixin):
             combine: bool = False,
             priority: list[str] = [],
             **kwargs,
-        ) -> xarray.Dataset:
+        ) -> 'xarray.Dataset':
         """Open a dataset directly from the search result
         
         :param id:      (str) The ID or index of the dataset in the resulting cluster.
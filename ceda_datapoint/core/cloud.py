@@ -2,12 +2,28 @@ __author__    = "Daniel Westwood"
 __contact__   = "daniel.westwood@stfc.ac.uk"
 __copyright__ = "Copyright 2024 United Kingdom Research and Innovation"
 
-import fsspec
-import xarray as xr
+import asyncio
 import logging
-import requests
+import hashlib
 import json
 import os
+import time
+
+# requests, fsspec, xarray and aiohttp are imported at the point of
+# first use - they account for most of this module's cold import time
+# and users who only list products never need them.
+
+try:
+    # C-implemented parser - kerchunk reference files are large
+    # enough for the json decode to dominate cold open time.
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from ceda_datapoint.mixins import UIMixin, PropertiesMixin
 from ceda_datapoint.utils import hash_id, logstream
@@ -16,6 +32,235 @@ logger = logging.getLogger(__name__)
 logger.addHandler(logstream)
 logger.propagate = False
 
+# Single source of truth for the DAP prefix that maps hrefs onto
+# paths in the archive filesystem, plus the bytes form used by the
+# raw reference rewrite. The rewrite only targets the url slot of
+# ["url", offset, size] triples, so the anchor includes the array
+# open - a bare quote would also match hrefs inside inlined .zattrs
+# values, where the preceding quote is escaped.
+_DAP_PREFIX = 'https://dap.ceda.ac.uk'
+_DAP_PREFIX_BYTES = b'["' + _DAP_PREFIX.encode() + b'/'
+
+def _make_local_href(href: str) -> str:
+    """Map a DAP href onto its local path in the archive."""
+    return href.removeprefix(_DAP_PREFIX)
+
+# On-disk cache for downloaded kerchunk reference files.
+_KERCHUNK_CACHE = os.path.expanduser('~/.cache/datapoint')
+
+# Reference files larger than this are fetched in concurrent
+# byte-range requests - a single TCP stream leaves bandwidth unused
+# on high-latency links.
+_RANGE_THRESHOLD = 32 * 2**20
+_RANGE_WORKERS = 4
+
+def _ranged_download(href: str, length: int) -> bytes:
+    """
+    Fetch ``href`` as ``_RANGE_WORKERS`` concurrent byte-range GETs
+    and stitch the parts back together in order.
+    """
+    session = _get_http_session()
+    step = -(-length // _RANGE_WORKERS)
+    spans = [
+        (start, min(start + step, length) - 1)
+        for start in range(0, length, step)
+    ]
+
+    def _get_span(span):
+        import requests
+
+        resp = session.get(
+            href,
+            headers={'Range': f'bytes={span[0]}-{span[1]}'},
+            timeout=(3.05, 30)
+        )
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            # Server ignored the Range header - stitching full
+            # responses would corrupt the payload.
+            raise requests.HTTPError(
+                f'{href}: server did not honour byte-range request'
+            )
+        return resp.content
+
+    with ThreadPoolExecutor(max_workers=len(spans)) as ex:
+        return b''.join(ex.map(_get_span, spans))
+
+def _fetch_reference_bytes(href: str, expiry_time: int) -> bytes:
+    """
+    Download a reference file with on-disk caching. Within the expiry
+    window the cached copy is served directly; past it, a conditional
+    GET revalidates against the stored ETag so an unchanged remote
+    costs a 304 with no body instead of a full re-download.
+    """
+    os.makedirs(_KERCHUNK_CACHE, exist_ok=True)
+    cache_path = os.path.join(
+        _KERCHUNK_CACHE,
+        hashlib.sha256(href.encode()).hexdigest()[:16] + '.json'
+    )
+    etag_path = cache_path + '.etag'
+
+    headers = {}
+    if os.path.isfile(cache_path):
+        age = time.time() - os.path.getmtime(cache_path)
+        if age < expiry_time:
+            with open(cache_path, 'rb') as f:
+                return f.read()
+        if os.path.isfile(etag_path):
+            with open(etag_path) as f:
+                headers['If-None-Match'] = f.read().strip()
+
+    import requests
+
+    session = _get_http_session()
+
+    # Probe the size first - large files are pulled as parallel
+    # byte-range requests, and a matching ETag here serves the same
+    # purpose as a 304 on the conditional GET below.
+    data = etag = None
+    try:
+        probe = session.head(href, timeout=5)
+        remote_etag = probe.headers.get('ETag')
+        if (remote_etag is not None
+                and headers.get('If-None-Match') == remote_etag):
+            os.utime(cache_path)
+            with open(cache_path, 'rb') as f:
+                return f.read()
+        length = int(probe.headers.get('Content-Length') or 0)
+        if (length > _RANGE_THRESHOLD
+                and probe.headers.get('Accept-Ranges') == 'bytes'):
+            data = _ranged_download(href, length)
+            etag = remote_etag
+    except requests.RequestException:
+        data = None
+
+    if data is None:
+        resp = session.get(href, headers=headers, timeout=(3.05, 30))
+        if resp.status_code == 304:
+            # Unchanged - refresh the expiry window and serve from disk.
+            os.utime(cache_path)
+            with open(cache_path, 'rb') as f:
+                return f.read()
+        resp.raise_for_status()
+        data = resp.content
+        etag = resp.headers.get('ETag')
+
+    with open(cache_path, 'wb') as f:
+        f.write(data)
+    if etag:
+        with open(etag_path, 'w') as f:
+            f.write(etag)
+    elif os.path.isfile(etag_path):
+        os.remove(etag_path)
+    return data
+
+# Bounded LRU of fsspec reference mappers - rebuilding a mapper
+# re-reads the reference JSON and the zarr metadata every time.
+_MAPPER_CACHE = OrderedDict()
+_MAPPER_CACHE_SIZE = 64
+
+def clear_mapper_cache():
+    """
+    Clear the cached kerchunk reference mappers - use if remote
+    reference files may have changed within a session. Also drops
+    the in-process cache of parsed reference sets so the on-disk
+    copy is revalidated against the remote ETag on next open.
+    """
+    _MAPPER_CACHE.clear()
+    _fetch_kerchunk_make_local.cache_clear()
+
+# Shared session so repeated visibility probes reuse pooled connections
+# rather than opening a new TCP/TLS connection per product. Retries
+# with backoff are handled at the adapter layer.
+_HTTP_SESSION = None
+
+def _get_http_session():
+    """The shared pooled session, built on first use."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        import requests
+        from urllib3.util.retry import Retry
+
+        _HTTP_SESSION = requests.Session()
+        _HTTP_SESSION.mount(
+            'https://',
+            requests.adapters.HTTPAdapter(
+                pool_connections=32, pool_maxsize=32,
+                max_retries=Retry(
+                    total=3, backoff_factor=0.5,
+                    status_forcelist=[502, 503, 504],
+                    allowed_methods=['GET', 'HEAD'],
+                )
+            )
+        )
+    return _HTTP_SESSION
+
+@lru_cache(maxsize=4096)
+def _head_status(href: str) -> int:
+    """
+    Status code from a HEAD request to ``href``, memoised per href so
+    multiple products pointing at the same resource probe it only once.
+    """
+    return _get_http_session().head(
+        href, allow_redirects=False, timeout=5
+    ).status_code
+
+def clear_visibility_cache():
+    """
+    Clear the cached visibility probes - use if remote resources
+    may have changed reachability within a session.
+    """
+    _head_status.cache_clear()
+
+async def _probe_many(hrefs: list) -> dict:
+    """
+    HEAD every href under a single event loop, returning an
+    ``href -> status code`` mapping. Failed probes map to None.
+    """
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=32)
+    timeout = aiohttp.ClientTimeout(total=5)
+
+    async def _head(session, href):
+        try:
+            async with session.head(
+                    href, allow_redirects=False
+                ) as resp:
+                return resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+        statuses = await asyncio.gather(
+            *[_head(session, h) for h in hrefs]
+        )
+    return dict(zip(hrefs, statuses))
+
+def _preload_local_index(hrefs: list) -> dict:
+    """
+    Build a ``dirname -> set(filenames)`` index for the local paths
+    behind a set of hrefs, using one ``os.scandir`` per directory
+    rather than one stat per file - cold archive mounts make a
+    per-product stat-storm expensive.
+    """
+    dirnames = set()
+    for href in hrefs:
+        dirnames.add(os.path.dirname(_make_local_href(href)))
+
+    index = {}
+    for dirname in dirnames:
+        try:
+            with os.scandir(dirname) as entries:
+                index[dirname] = {
+                    e.name for e in entries if e.is_file()
+                }
+        except OSError:
+            index[dirname] = set()
+    return index
+
 class DataPointCluster(UIMixin):
     """
     A set of non-combined datasets opened using the DataPointSearch
@@ -62,9 +307,85 @@ class DataPointCluster(UIMixin):
             elif p is not None:
                 self._products[p.id] = p
 
+        # Rebuilt after the visibility sweep so integer indexing only
+        # covers the products the filtered listing shows.
+        self._product_ids = tuple(self._products.keys())
+
         self._meta = meta
         self._meta['products'] = len(products)
 
+        self._local_index = {}
+        self._probed = False
+        self._repr_cache = None
+
+    def _probe_products(self):
+        """
+        Probe the visibility of all products in this cluster, if not
+        already done. Deferred from ``__init__`` so products that are
+        never enumerated pay nothing, then fanned out across a thread
+        pool since each probe is a blocking HEAD request - a serial
+        sweep costs one round-trip per product.
+        """
+        if self._probed or len(self._products) == 0:
+            return
+
+        # One scandir per directory replaces one stat per product.
+        self._local_index = _preload_local_index(
+            [p.href for p in self._products.values()]
+        )
+
+        # For larger clusters, sweep all the remote HEAD requests
+        # under one event loop so they share a pooled TCP connector.
+        statuses = {}
+        if len(self._products) > 4:
+            remote = [
+                p.href for p in self._products.values()
+                if p.href.startswith('https://') and not p._probed
+            ]
+            if remote:
+                try:
+                    statuses = asyncio.run(_probe_many(remote))
+                except RuntimeError:
+                    # Already inside an event loop (e.g. a notebook)
+                    # - fall back to the threaded sweep.
+                    statuses = {}
+
+        def _probe(p):
+            try:
+                p.probe_visibility(
+                    local_index=self._local_index,
+                    head_status=statuses.get(p.href))
+            except Exception:
+                # The href could not be reached at all - re-probe
+                # with a definite failed status so the product
+                # resolves from the local index alone, rather than
+                # leaving the sweep in a partial state.
+                logger.warning(
+                    f'Visibility probe failed for "{p.id}" - '
+                    'resolving from the local path only.'
+                )
+                p.probe_visibility(
+                    local_index=self._local_index, head_status=0)
+
+        if len(self._products) == 1:
+            # Skip the executor overhead for a single product.
+            _probe(next(iter(self._products.values())))
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=min(16, len(self._products))
+                ) as ex:
+                list(ex.map(_probe, self._products.values()))
+
+        # Hide unreachable products from integer indexing, matching
+        # the filtered products listing. Marked complete only once
+        # every product has a definite visibility and the filtered
+        # indexing is rebuilt.
+        self._product_ids = tuple(
+            p.id for p in self._products.values()
+            if p.visibility != 'unreachable' or self.show_unreachable
+        )
+        self._probed = True
+
     def __str__(self):
         """String representation of this class"""
         return f'<DataPointCluster: {self._id} (Datasets: {len(self._products)})>'
@@ -75,10 +396,12 @@ class DataPointCluster(UIMixin):
         by ID or position in the cluster.
         """
 
+        self._probe_products()
+
         if isinstance(index, int):
-            index = list(self._products.keys())[index]
+            index = self._product_ids[index]
 
-        if index not in self._products:
+        if index not in self._product_ids:
             raise IndexError(
                 f'"{index}" not found in available products.'
             )
@@ -87,6 +410,7 @@ class DataPointCluster(UIMixin):
     @property
     def products(self):
         """List of products contained within this cluster"""
+        self._probe_products()
         return [ v for v in self._products.values() if v.visibility != 'unreachable' or self.show_unreachable]
 
     def help(self):
@@ -102,6 +426,9 @@ class DataPointCluster(UIMixin):
 
     def __repr__(self) -> str:
         """Notebooks representation of this class"""
+        if self._repr_cache is not None:
+            return self._repr_cache
+        self._probe_products()
         repr = super().__repr__().split('\n')
         repr.append('Products:')
         for p in self._products.values():
@@ -109,7 +436,10 @@ class DataPointCluster(UIMixin):
                 repr.append(f' - {p.id}: {p.cloud_format} ({p.visibility})')
             else:
                 repr.append(f' - {p.id}: {p.cloud_format}')
-        return '\n'.join(repr)
+        # Safe to cache - products and their visibility are fixed
+        # once probed.
+        self._repr_cache = '\n'.join(repr)
+        return self._repr_cache
     
     def open_dataset(
             self,
@@ -117,7 +447,7 @@ class DataPointCluster(UIMixin):
             mode: str = 'xarray',
             local_only: bool = False,
             **kwargs,
-        ) -> xr.Dataset:
+        ) -> 'xr.Dataset':
         """
         Open a dataset from within this cluster's cloud products. A 
         dataset can be indexed either by id or position within this 
@@ -137,10 +467,12 @@ class DataPointCluster(UIMixin):
         
         local_only = local_only or self._local_only
         
+        self._probe_products()
+
         if isinstance(id, int):
-            id = list(self._products.keys())[id]
-        
-        if id not in self._products:
+            id = self._product_ids[id]
+
+        if id not in self._product_ids:
             logger.warning(
                 f'"{id}" not found in available datasets.'
             )
@@ -204,17 +536,30 @@ class DataPointCloudProduct(PropertiesMixin):
         self._cloud_format = cf
         
         self._asset_stac = asset_stac
-        self._meta = meta | {
-            'asset_id': id,
-            'cloud_format': cf
-        }
+
+        # One copy, no temporary merge dict - the caller's meta is
+        # shared across products so it must not be mutated directly.
+        self._meta = dict(meta)
+        self._meta['asset_id'] = id
+        self._meta['cloud_format'] = cf
 
         self._stac_attrs = stac_attrs
         self._properties = properties
 
-        self.visibility = 'all'
+        self._visibility = None
+        self._probed = False
+        self._repr_cache = None
 
-        self._set_visibility()
+    @property
+    def visibility(self):
+        """
+        Visibility of this product - probed on first access, so
+        products that are never opened or enumerated pay no HEAD
+        request.
+        """
+        if self._visibility is None:
+            self.probe_visibility()
+        return self._visibility
 
     @property
     def cloud_format(self):
@@ -231,11 +576,14 @@ class DataPointCloudProduct(PropertiesMixin):
     
     def __repr__(self):
         """Representation of this class using the meta components"""
+        if self._repr_cache is not None:
+            return self._repr_cache
         repr = super().__repr__().split('\n')
         repr.append('Attributes:')
-        for k, v in self._properties.items():
-            repr.append(f' - {k}: {v}')
-        return '\n'.join(repr)
+        repr += [f' - {k}: {v}' for k, v in self._properties.items()]
+        # Meta and properties are fixed after construction.
+        self._repr_cache = '\n'.join(repr)
+        return self._repr_cache
 
     def help(self):
         """Display public methods for this object."""
@@ -257,12 +605,21 @@ class DataPointCloudProduct(PropertiesMixin):
 
         :param local_only:  (bool) Switch to using local-only files - DataPoint will
             convert all hrefs and internal Kerchunk links to use local paths.
+
+        Kerchunk datasets also accept a ``block_size`` kwarg to tune
+        the read buffer on the underlying filesystems.
         """
         if not self._cloud_format:
             raise ValueError(
                 'No cloud format given for this dataset'
             )
         
+        if self.visibility == 'unreachable':
+            logger.warning(
+                'Href not reachable via https or local path - '
+                'this open is expected to fail.'
+            )
+
         if self.visibility == 'local-only' and not local_only:
             raise ValueError(
                 'Href not reachable via https, please use `local_only=True` '
@@ -289,35 +646,60 @@ class DataPointCloudProduct(PropertiesMixin):
     def _open_kerchunk(
             self,
             local_only: bool = False,
+            block_size: int = 8 * 2**20,
             **kwargs,
-        ) -> xr.Dataset:
-        
+        ) -> 'xr.Dataset':
+
         """
         Open a kerchunk dataset in xarray
-        
+
         :param local_only:  (bool) Switch to using local-only files - DataPoint will
             convert all hrefs and internal Kerchunk links to use local paths.
+
+        :param block_size:  (int) Read buffer size in bytes for the
+            underlying filesystems - larger buffers amortise the HTTP
+            round-trip cost across many zarr chunks.
         """
-        
+
         if 'href' not in self._asset_stac:
             raise ValueError(
                 'Cloud assets with no "href" are not supported'
             )
         href = self._asset_stac['href']
-        
+
         mapper_kwargs = self._asset_stac.get('mapper_kwargs') or {}
+        if block_size is not None:
+            # Asset-supplied mapper kwargs take precedence.
+            mapper_kwargs = {
+                'target_options': {'block_size': block_size},
+                'remote_options': {'block_size': block_size},
+            } | mapper_kwargs
         open_zarr_kwargs = self._asset_stac.get('open_zarr_kwargs') or {}
 
-        if local_only:
-            href = _fetch_kerchunk_make_local(href)
-
-        mapper = fsspec.get_mapper(
-            'reference://',
-            fo=href,
-            **mapper_kwargs
-        )
+        import fsspec
+        import xarray as xr
+
+        cache_key = (href, local_only, str(sorted(mapper_kwargs.items())))
+        mapper = _MAPPER_CACHE.get(cache_key)
+        if mapper is not None:
+            _MAPPER_CACHE.move_to_end(cache_key)
+        else:
+            fo = href
+            if local_only:
+                fo = _fetch_kerchunk_make_local(href)
+
+            mapper = fsspec.get_mapper(
+                'reference://',
+                fo=fo,
+                **mapper_kwargs
+            )
+            _MAPPER_CACHE[cache_key] = mapper
+            if len(_MAPPER_CACHE) > _MAPPER_CACHE_SIZE:
+                _MAPPER_CACHE.popitem(last=False)
 
-        zarr_kwargs = _zarr_kwargs_default(add_kwargs=open_zarr_kwargs) | kwargs
+        # The defaults dict is freshly built, so update it in place.
+        zarr_kwargs = _zarr_kwargs_default(add_kwargs=open_zarr_kwargs)
+        zarr_kwargs.update(kwargs)
 
         return xr.open_zarr(mapper, **zarr_kwargs)
 
@@ -325,7 +707,7 @@ class DataPointCloudProduct(PropertiesMixin):
             self,
             cfa_options: dict = None,
             **kwargs,
-        ) -> xr.Dataset:
+        ) -> 'xr.Dataset':
 
         """
         Open a CFA dataset in xarray
@@ -333,6 +715,8 @@ class DataPointCloudProduct(PropertiesMixin):
         :param cfa_options:     (dict) Configuration options to pass to the CFA engine
         """
 
+        import xarray as xr
+
         cfa_options = cfa_options or {}
 
         if 'href' not in self._asset_stac:
@@ -348,57 +732,104 @@ class DataPointCloudProduct(PropertiesMixin):
             engine='CFA', cfa_options=cfa_options, **open_xarray_kwargs
         )
 
-    def _set_visibility(self):
+    def probe_visibility(
+            self,
+            local_index: dict = None,
+            head_status: int = None
+        ):
+        """
+        Determine the visibility of this product, if not already
+        probed. Deferred from ``__init__`` so a cluster of products
+        can fan the probes out in parallel.
+
+        :param local_index: (dict) Preloaded ``dirname -> filenames``
+            index of local files, to skip per-product stat calls.
+
+        :param head_status: (int) Status code from a probe already
+            performed at the cluster level - skips the HEAD request.
+        """
+        if self._probed:
+            return
+        self._set_visibility(
+            local_index=local_index, head_status=head_status)
+        self._probed = True
+
+    def _set_visibility(
+            self,
+            local_index: dict = None,
+            head_status: int = None
+        ):
         """Determine if this product is reachable"""
-        if 'https://' in self.href:
+        # Computed into a local and assigned only on success - if the
+        # probe raises, the product must stay un-probed rather than
+        # reporting 'all' for a reachability that was never checked.
+        visibility = 'all'
+        if self.href.startswith('https://'):
             # Check remote link
-            status = requests.head(self.href)
-            if status.status_code != 200:
-                self.visibility = 'local-only'
+            if head_status is None:
+                head_status = _head_status(self.href)
+            if head_status != 200:
+                visibility = 'local-only'
             else:
+                self._visibility = visibility
                 return
         
         # Check local link
-        local_ref = self.href.replace('https://dap.ceda.ac.uk','')
-        if not os.path.isfile(local_ref):
-            self.visibility = 'unreachable'
+        local_ref = _make_local_href(self.href)
+        if local_index is not None:
+            dirname, filename = os.path.split(local_ref)
+            exists = filename in local_index.get(dirname, set())
+        else:
+            exists = os.path.isfile(local_ref)
+        if not exists:
+            visibility = 'unreachable'
+        self._visibility = visibility
 
 def _zarr_kwargs_default(add_kwargs={}):
 
     defaults = {
         'consolidated':False,
     }
-    return defaults | add_kwargs
+    if add_kwargs:
+        defaults.update(add_kwargs)
+    return defaults
 
-def _fetch_kerchunk_make_local(href: str):
+@lru_cache(maxsize=64)
+def _fetch_kerchunk_make_local(href: str, expiry_time: int = 86400):
     """
     Fetch a kerchunk file, open as json content and do find/replace
-    to access local files only.
+    to access local files only. Downloads are cached on disk (keyed
+    by url) so repeat opens skip the network entirely, and the parsed
+    refs are memoised in-process. The payload is kept as a single
+    bytes buffer end-to-end - no intermediate str decode - to hold
+    peak memory down on multi-MB reference files.
+
+    :param expiry_time: (int) Seconds before the on-disk cached copy
+        is considered stale and re-downloaded.
     """
-    href_local = href.replace('https://dap.ceda.ac.uk','')
+    import requests
+
+    href_local = _make_local_href(href)
     if not os.path.isfile(href_local):
-        attempts = 0
-        success = False
-        while attempts < 3 and not success:
-            resp = requests.get(href)
-            if resp.status_code == 200:
-                success = True
-            attempts += 1
-        if attempts >= 3 and not success:
+        # Retries with backoff happen once, at the session's adapter
+        # layer - a second loop here would compound them.
+        try:
+            data = _fetch_reference_bytes(href, expiry_time)
+        except (OSError, requests.RequestException) as err:
             raise ValueError(
                 f'File {href}: Download unsuccessful - '
-                'could not download the file successfully (tried 3 times)'
+                f'could not download the file successfully ({err})'
             )
-        refs = json.loads(resp.text)
     else:
-        with open(href_local) as f:
-            refs = json.load(f)
-
-    for key in refs['refs'].keys():
-        v = refs['refs'][key]
-        if isinstance(v, list) and len(v) == 3:
-            # First character
-            if 'https://' in v[0]:
-                refs['refs'][key][0] = v[0].replace('https://dap.ceda.ac.uk/','/')
-    return refs
+        with open(href_local, 'rb') as f:
+            data = f.read()
+
+    # Localise hrefs on the raw bytes before parsing - one C-level
+    # replace beats touching every reference in python. The array
+    # anchor restricts the match to the url slot of reference
+    # triples, leaving inlined metadata values untouched. References
+    # that are already local (or fully inlined) skip the rewrite.
+    if _DAP_PREFIX_BYTES in data:
+        data = data.replace(_DAP_PREFIX_BYTES, b'["/')
+    return _json_loads(data)
 
@@ -3,7 +3,6 @@ __contact__   = "daniel.westwood@stfc.ac.uk"
 __copyright__ = "Copyright 2024 United Kingdom Research and Innovation"
 
 import logging
-import xarray
 
 from ceda_datapoint.mixins import PropertiesMixin, UIMixin
 from ceda_datapoint.utils import method_format, logstream
@@ -212,7 +211,7 @@ class DataPointItem(PropertiesMixin):
             id: int = 0,
             priority: list = None,
             **kwargs
-        ) -> xarray.Dataset:
+        ) -> 'xarray.Dataset':
         """
         Open a specific dataset, skip retrieving the cloud product
         
@@ -312,12 +311,11 @@ class DataPointItem(PropertiesMixin):
                 order = priority.index(cf)
                 asset_id = f'{self._id}-{id}'
                 a = DataPointCloudProduct(
-                    asset, 
+                    asset,
                     id=asset_id, cf=cf, order=order, meta=self._meta,
                     stac_attrs=self._stac_attrs, properties=self._properties)
-                if show_unreachable or a.visibility != 'unreachable':
-                    asset_list.append(a)
-            
+                asset_list.append(a)
+
 
         if len(asset_list) == 0:
             logger.warning(
@@ -325,7 +323,17 @@ class DataPointItem(PropertiesMixin):
             )
             return None
         elif len(asset_list) > 1:
-            return DataPointCluster(asset_list, meta=self._meta, parent_id=self._id)
+            # Visibility probes are handled (in parallel) by the cluster.
+            return DataPointCluster(
+                asset_list, meta=self._meta, parent_id=self._id,
+                show_unreachable=show_unreachable)
         else:
-            return asset_list[0]
+            product = asset_list[0]
+            # Accessing visibility triggers the (lazy) probe.
+            if not show_unreachable and product.visibility == 'unreachable':
+                logger.warning(
+                    f'No dataset from {priority} found (id={self._id})'
+                )
+                return None
+            return product
     
\ No newline at end of file
@@ -1,8 +1,227 @@
-from ceda_datapoint.core.cloud import DataPointCluster
+import os
+import time
+
+import pytest
+import requests
+
+from ceda_datapoint.core import cloud
+from ceda_datapoint.core.cloud import (
+    DataPointCloudProduct,
+    DataPointCluster,
+    _make_local_href,
+    _preload_local_index,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'status {self.status_code}')
+
+
+class FakeSession:
+    """Scripted stand-in for the pooled HTTP session."""
+
+    def __init__(self, head=None, get=None):
+        self._head = head
+        self._get = get
+        self.get_headers = []
+
+    def head(self, href, **kwargs):
+        if self._head is None:
+            raise AssertionError('Unexpected HEAD request')
+        if isinstance(self._head, Exception):
+            raise self._head
+        return self._head
+
+    def get(self, href, headers=None, **kwargs):
+        if self._get is None:
+            raise AssertionError('Unexpected GET request')
+        self.get_headers.append(headers or {})
+        return self._get(headers or {})
+
+
+def _use_session(monkeypatch, tmp_path, session):
+    monkeypatch.setattr(cloud, '_HTTP_SESSION', session)
+    monkeypatch.setattr(cloud, '_KERCHUNK_CACHE', str(tmp_path / 'cache'))
+
+
+def _product(id, href):
+    return DataPointCloudProduct(
+        {'href': href}, id=id, cf='kerchunk',
+        meta={}, stac_attrs={}, properties={})
+
 
 def test_cluster():
     dpc = DataPointCluster([], 'test_search',meta={})
     assert hasattr(dpc, 'meta')
 
+
+def test_make_local_href():
+    assert _make_local_href('https://dap.ceda.ac.uk/badc/f.nc') == '/badc/f.nc'
+    assert _make_local_href('/already/local.nc') == '/already/local.nc'
+
+
+def test_preload_local_index(tmp_path):
+    (tmp_path / 'ref.json').write_text('{}')
+    index = _preload_local_index([
+        str(tmp_path / 'ref.json'),
+        '/nonexistent/dir/other.json',
+    ])
+    assert index[str(tmp_path)] == {'ref.json'}
+    assert index['/nonexistent/dir'] == set()
+
+
+def test_lazy_visibility(tmp_path):
+    local = tmp_path / 'ref.json'
+    local.write_text('{}')
+
+    product = _product('p0', str(local))
+    assert not product._probed
+    assert product.visibility == 'all'
+    assert product._probed
+
+    missing = _product('p1', str(tmp_path / 'missing.json'))
+    assert missing.visibility == 'unreachable'
+
+
+def test_failed_probe_not_cached(monkeypatch, tmp_path):
+    # A probe that raises must leave the product un-probed, not
+    # report 'all' for a reachability that was never determined.
+    session = FakeSession(head=requests.ConnectionError('dns down'))
+    _use_session(monkeypatch, tmp_path, session)
+
+    product = _product('p0', 'https://x/probe-fail/ref.json')
+    with pytest.raises(requests.ConnectionError):
+        product.visibility
+    assert not product._probed
+    assert product._visibility is None
+
+    session._head = FakeResponse(200)
+    assert product.visibility == 'all'
+
+
+def test_cluster_hides_unreachable(tmp_path):
+    local = tmp_path / 'ref.json'
+    local.write_text('{}')
+
+    dpc = DataPointCluster([
+        _product('p0', str(tmp_path / 'missing.json')),
+        _product('p1', str(local)),
+    ], 'test_search', meta={})
+
+    assert [p.id for p in dpc.products] == ['p1']
+    assert dpc[0].id == 'p1'
+    assert dpc.open_dataset('p0') is None
+
+
+def test_cluster_sweep_survives_probe_failure(monkeypatch, tmp_path):
+    # A probe raising mid-sweep must not leave the cluster in a
+    # partial state - every product gets a definite visibility and
+    # the filtered indexing is still rebuilt.
+    local = tmp_path / 'ref.json'
+    local.write_text('{}')
+
+    session = FakeSession(head=requests.ConnectionError('dns down'))
+    _use_session(monkeypatch, tmp_path, session)
+
+    dpc = DataPointCluster([
+        _product('p0', 'https://x/sweep-fail/ref.json'),
+        _product('p1', str(local)),
+    ], 'test_search', meta={})
+
+    assert [p.id for p in dpc.products] == ['p1']
+    assert dpc._probed
+    assert dpc._products['p0'].visibility == 'unreachable'
+
+
+def test_fetch_fresh_cache(monkeypatch, tmp_path):
+    # A cache copy inside the expiry window is served with no network.
+    session = FakeSession()
+    _use_session(monkeypatch, tmp_path, session)
+
+    os.makedirs(cloud._KERCHUNK_CACHE)
+    first = FakeSession(
+        head=requests.ConnectionError('no head'),
+        get=lambda headers: FakeResponse(200, b'{"refs": {}}')
+    )
+    monkeypatch.setattr(cloud, '_HTTP_SESSION', first)
+    assert cloud._fetch_reference_bytes('https://x/ref.json', 60) == b'{"refs": {}}'
+
+    monkeypatch.setattr(cloud, '_HTTP_SESSION', session)
+    assert cloud._fetch_reference_bytes('https://x/ref.json', 60) == b'{"refs": {}}'
+
+
+def test_fetch_etag_revalidation(monkeypatch, tmp_path):
+    # Past expiry, a matching ETag (via HEAD or a 304) serves the
+    # cached copy and refreshes the window.
+    session = FakeSession(
+        head=requests.ConnectionError('no head'),
+        get=lambda headers: FakeResponse(
+            200, b'v1', headers={'ETag': 'tag-1'})
+    )
+    _use_session(monkeypatch, tmp_path, session)
+
+    assert cloud._fetch_reference_bytes('https://x/ref.json', 60) == b'v1'
+
+    # Expire the cached copy.
+    cache_file = os.listdir(cloud._KERCHUNK_CACHE)
+    cache_path = [
+        os.path.join(cloud._KERCHUNK_CACHE, f)
+        for f in cache_file if f.endswith('.json')
+    ][0]
+    stale = time.time() - 3600
+    os.utime(cache_path, (stale, stale))
+
+    # HEAD reporting the stored ETag short-circuits the GET.
+    session._head = FakeResponse(200, headers={'ETag': 'tag-1'})
+    session._get = None
+    assert cloud._fetch_reference_bytes('https://x/ref.json', 60) == b'v1'
+    assert os.path.getmtime(cache_path) > stale
+
+    # A 304 on the conditional GET does the same.
+    os.utime(cache_path, (stale, stale))
+    session._head = requests.ConnectionError('no head')
+    session._get = lambda headers: FakeResponse(304)
+    assert cloud._fetch_reference_bytes('https://x/ref.json', 60) == b'v1'
+    assert session.get_headers[-1]['If-None-Match'] == 'tag-1'
+
+
+def test_ranged_download(monkeypatch, tmp_path):
+    payload = bytes(range(10))
+
+    def ranged_get(headers):
+        span = headers['Range'].removeprefix('bytes=').split('-')
+        start, end = int(span[0]), int(span[1])
+        return FakeResponse(206, payload[start:end + 1])
+
+    session = FakeSession(get=ranged_get)
+    _use_session(monkeypatch, tmp_path, session)
+
+    assert cloud._ranged_download('https://x/big.json', len(payload)) == payload
+
+
+def test_ranged_fallback(monkeypatch, tmp_path):
+    # A server that advertises ranges but answers with full bodies
+    # must fall back to the single GET rather than stitch corruption.
+    payload = b'{"refs": {}}'
+    session = FakeSession(
+        head=FakeResponse(200, headers={
+            'Content-Length': str(len(payload)),
+            'Accept-Ranges': 'bytes',
+        }),
+        get=lambda headers: FakeResponse(200, payload)
+    )
+    _use_session(monkeypatch, tmp_path, session)
+    monkeypatch.setattr(cloud, '_RANGE_THRESHOLD', 4)
+
+    assert cloud._fetch_reference_bytes('https://x/big.json', 60) == payload
+
+
 if __name__ == '__main__':
-    test_cluster()
\ No newline at end of file
+    test_cluster()